@@ -1,15 +1,17 @@
 import pandas as pd
 import numpy as np
-import requests
+from urllib3.util.retry import Retry
 from kiteconnect import KiteConnect
 import datetime
 import time
 import os
+import csv
 import json
-import math
+from concurrent.futures import ThreadPoolExecutor
 from scipy.stats import norm
 import gspread
-from oauth2client.service_account import ServiceAccountCredentials
+from google.oauth2.service_account import Credentials
+from common import CSV_ENGINE, HAVE_PYARROW
 
 # ---------------------- CONFIG ----------------------
 symbol = "NIFTY"
@@ -18,14 +20,21 @@ iv_input = float(input("Enter Implied Volatility (e.g., 0.15 for 15%): ").strip(
 
 # ---------------------- GOOGLE SHEET AUTH ----------------------
 gcreds = json.loads(os.environ["GCREDS"])
-scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-creds = ServiceAccountCredentials.from_json_keyfile_dict(gcreds, scope)
+scope = ["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"]
+creds = Credentials.from_service_account_info(gcreds, scopes=scope)
 client = gspread.authorize(creds)
-sheet = client.open("ZerodhaTokenStore").worksheet("Sheet1")
-api_key = sheet.acell("A1").value.strip()
-access_token = sheet.acell("C1").value.strip()
-
-kite = KiteConnect(api_key=api_key)
+sheet = client.open_by_key(os.environ["TOKEN_SHEET_ID"]).worksheet("Sheet1")
+# A1 = api_key, B1 = api_secret, C1 = access_token, D1 = last updated; one batchGet instead of a read per cell
+token_row = (sheet.batch_get(["A1:D1"])[0] or [[]])[0]
+api_key, _, access_token, _ = (c.strip() for c in (token_row + [""] * 4)[:4])
+
+# One pooled session with retries on transient errors; at most two requests are in flight
+# (the background spot history and the foreground instrument/LTP calls)
+kite = KiteConnect(api_key=api_key, pool={
+    "pool_connections": 2,
+    "pool_maxsize": 2,
+    "max_retries": Retry(total=3, backoff_factor=0.3, status_forcelist=(429, 502, 503, 504)),
+})
 kite.set_access_token(access_token)
 
 print("🔐 API Key:", api_key)
@@ -42,86 +51,111 @@ if today in nse_holidays or today.weekday() >= 5:
     print("🚫 Market is closed today.")
     exit()
 
+# ---------------------- SPOT HISTORY (BACKGROUND) ----------------------
+# Independent of the instrument list, so start it now and let it overlap the download + LTP fetch
+from_time = datetime.datetime.combine(today, datetime.time(9, 15))
+to_time = datetime.datetime.combine(today, datetime.time(15, 30))
+spot_token = 256265
+spot_pool = ThreadPoolExecutor(max_workers=1)
+spot_future = spot_pool.submit(kite.historical_data, spot_token, from_time, to_time, interval="5minute")
+spot_pool.shutdown(wait=False)
+
 # ---------------------- LOAD INSTRUMENTS ----------------------
 instr_file = "instruments.csv"
-if not os.path.exists(instr_file):
-    print("⬇️ Downloading instrument list from Zerodha...")
-    url = "https://api.kite.trade/instruments"
-    response = requests.get(url)
+# The instrument master changes once per trading day: reuse today's download, refresh a stale one
+if not os.path.exists(instr_file) or datetime.date.fromtimestamp(os.path.getmtime(instr_file)) != today:
+    print("⬇️ Downloading NFO instrument list from Zerodha...")
+    url = "https://api.kite.trade/instruments/NFO"
+    response = kite.reqsession.get(url)
     with open(instr_file, "w") as f:
         f.write(response.text)
     print("✅ Instrument list cached.")
 
-instruments = pd.read_csv(instr_file)
+# Only the columns used below; the repeated string columns are stored as categoricals
+instruments = pd.read_csv(
+    instr_file,
+    engine=CSV_ENGINE,
+    usecols=["tradingsymbol", "name", "expiry", "strike", "instrument_type", "segment", "exchange"],
+    dtype={"name": "category", "instrument_type": "category", "segment": "category", "exchange": "category"},
+)
 opt_chain = instruments[(instruments["segment"] == "NFO-OPT") & (instruments["name"] == symbol)]
 
 # ---------------------- GET NEAREST EXPIRY ----------------------
-expiries = sorted(opt_chain["expiry"].unique())
-if not expiries:
+# ISO dates order correctly, so the nearest expiry is just the column minimum
+if opt_chain.empty:
     raise Exception("❌ No expiry found for NIFTY")
-nearest_expiry = expiries[0]
+nearest_expiry = opt_chain["expiry"].min()
 opt_chain = opt_chain[opt_chain["expiry"] == nearest_expiry]
 print(f"🎯 Nearest Expiry: {nearest_expiry}")
 
-# ---------------------- BLACK-SCHOLES GREEKS ----------------------
-def calculate_greeks(option_type, spot, strike, iv, time_to_expiry):
+# ---------------------- LIVE LTP CHECK ----------------------
+# Options without a quote are skipped; fetch them once in 1000-symbol chunks (Kite's per-call limit)
+# instead of one kite.ltp call per option per interval. Serial, since the quote endpoints allow
+# about one request per second; the session already retries 429/5xx.
+LTP_CHUNK = 1000
+
+ltp_symbols = (opt_chain["exchange"].astype(str) + ":" + opt_chain["tradingsymbol"]).tolist()
+ltp_map = {}
+for start in range(0, len(ltp_symbols), LTP_CHUNK):
+    chunk = ltp_symbols[start:start + LTP_CHUNK]
     try:
-        d1 = (math.log(spot / strike) + (risk_free_rate + 0.5 * iv ** 2) * time_to_expiry) / (iv * math.sqrt(time_to_expiry))
-        d2 = d1 - iv * math.sqrt(time_to_expiry)
-        delta = norm.cdf(d1) if option_type == "CE" else -norm.cdf(-d1)
-        vega = spot * norm.pdf(d1) * math.sqrt(time_to_expiry) / 100
-        theta = (-spot * norm.pdf(d1) * iv / (2 * math.sqrt(time_to_expiry))) / 365
-        if option_type == "PE":
-            theta -= risk_free_rate * strike * math.exp(-risk_free_rate * time_to_expiry) * norm.cdf(-d2) / 365
-        else:
-            theta -= risk_free_rate * strike * math.exp(-risk_free_rate * time_to_expiry) * norm.cdf(d2) / 365
-        return delta, vega, theta
-    except Exception:
-        return 0, 0, 0
+        ltp_map.update(kite.ltp(chunk))
+    except Exception as e:
+        # A missing chunk would silently drop strikes from every interval's sums: abort instead
+        raise RuntimeError(f"❌ LTP fetch failed for {len(chunk)} symbols: {e}") from e
+opt_chain = opt_chain[[s in ltp_map for s in ltp_symbols]]
+print(f"📡 Quotes available for {len(opt_chain)} of {len(ltp_symbols)} options")
+
+# ---------------------- BLACK-SCHOLES GREEKS ----------------------
+# Vectorized over strikes; sign is +1 for CE and -1 for PE, so each CDF is evaluated once per strike.
+# Invalid inputs (e.g. expired) come out as NaN and fail the delta filter
+def calculate_greeks(sign, spot, strike, iv, time_to_expiry):
+    sqrt_t = np.sqrt(time_to_expiry)
+    d1 = (np.log(spot / strike) + (risk_free_rate + 0.5 * iv ** 2) * time_to_expiry) / (iv * sqrt_t)
+    d2 = d1 - iv * sqrt_t
+    pdf_d1 = norm.pdf(d1)
+    delta = sign * norm.cdf(sign * d1)
+    vega = spot * pdf_d1 * sqrt_t / 100
+    theta = (-spot * pdf_d1 * iv / (2 * sqrt_t)
+             - risk_free_rate * strike * np.exp(-risk_free_rate * time_to_expiry) * norm.cdf(sign * d2)) / 365
+    return delta, vega, theta
 
 # ---------------------- HISTORICAL SNAPSHOT ----------------------
-from_time = datetime.datetime.combine(today, datetime.time(9, 15))
-to_time = datetime.datetime.combine(today, datetime.time(15, 30))
 intervals = pd.date_range(from_time, to_time, freq="5min")
 
 try:
-    spot_token = 256265
-    spot_df = kite.historical_data(spot_token, from_time, to_time, interval="5minute")
+    spot_df = spot_future.result()
     spot_prices = pd.DataFrame(spot_df)["close"].values
 except Exception as e:
     print(f"❌ Failed to fetch spot historical data: {e}")
     exit()
 
+expiry_ts = pd.to_datetime(nearest_expiry, format="%Y-%m-%d")
+# Option chain as flat arrays for the vectorized Greeks below
+strikes = opt_chain["strike"].to_numpy(dtype=np.float64)
+is_ce = (opt_chain["instrument_type"] == "CE").to_numpy()
+is_pe = ~is_ce
+sign = np.where(is_ce, 1.0, -1.0)
+# (n, 2) CE/PE indicator columns: one matmul gives all six side sums
+side_matrix = np.column_stack((is_ce, is_pe)).astype(np.float64)
+SECONDS_PER_YEAR = 365 * 24 * 60 * 60
+GREEK_COLS = ["ce_delta", "pe_delta", "ce_vega", "pe_vega", "ce_theta", "pe_theta"]
 open_log = None
-log_records = []
+snapshots = []
 
 for i, timestamp in enumerate(intervals):
     try:
         spot = spot_prices[i]
-        time_to_expiry = (pd.to_datetime(nearest_expiry) - timestamp).total_seconds() / (365 * 24 * 60 * 60)
-
-        ce_delta_sum = pe_delta_sum = ce_vega_sum = pe_vega_sum = ce_theta_sum = pe_theta_sum = 0
-
-        for _, row in opt_chain.iterrows():
-            try:
-                token = row["instrument_token"]
-                strike = row["strike"]
-                opt_type = row["instrument_type"]  # CE or PE
-                tradingsymbol = row["tradingsymbol"]
-                ltp_data = kite.ltp([f"{row['exchange']}:{tradingsymbol}"])
-                ltp = ltp_data[f"{row['exchange']}:{tradingsymbol}"]["last_price"]
-                delta, vega, theta = calculate_greeks(opt_type, spot, strike, iv_input, time_to_expiry)
-                if 0.05 <= abs(delta) <= 0.60:
-                    if opt_type == "CE":
-                        ce_delta_sum += delta
-                        ce_vega_sum += vega
-                        ce_theta_sum += theta
-                    else:
-                        pe_delta_sum += delta
-                        pe_vega_sum += vega
-                        pe_theta_sum += theta
-            except Exception as e:
-                continue
+        time_to_expiry = (expiry_ts - timestamp).total_seconds() / SECONDS_PER_YEAR
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            delta, vega, theta = calculate_greeks(sign, spot, strikes, iv_input, time_to_expiry)
+        abs_delta = np.abs(delta)
+        in_band = (abs_delta >= 0.05) & (abs_delta <= 0.60)
+        # zero out-of-band rows (may be NaN) so they drop out of the products
+        greeks = np.vstack((delta, vega, theta))
+        greeks[:, ~in_band] = 0.0
+        (ce_delta_sum, pe_delta_sum), (ce_vega_sum, pe_vega_sum), (ce_theta_sum, pe_theta_sum) = (greeks @ side_matrix).tolist()
 
         snapshot = {
             "timestamp": timestamp,
@@ -135,18 +169,14 @@ for i, timestamp in enumerate(intervals):
 
         if open_log is None:
             open_log = snapshot
-            pd.DataFrame([snapshot]).to_csv("greeks_open.csv", index=False)
+            # single row: write it directly rather than through a one-row DataFrame
+            with open("greeks_open.csv", "w", newline="") as f:
+                writer = csv.writer(f, lineterminator="\n")
+                writer.writerow(snapshot.keys())
+                writer.writerow(snapshot.values())
             print("✅ Saved 9:15 snapshot to greeks_open.csv")
 
-        log_records.append({
-            "timestamp": timestamp,
-            "ce_delta_change": snapshot["ce_delta"] - open_log["ce_delta"],
-            "pe_delta_change": snapshot["pe_delta"] - open_log["pe_delta"],
-            "ce_vega_change": snapshot["ce_vega"] - open_log["ce_vega"],
-            "pe_vega_change": snapshot["pe_vega"] - open_log["pe_vega"],
-            "ce_theta_change": snapshot["ce_theta"] - open_log["ce_theta"],
-            "pe_theta_change": snapshot["pe_theta"] - open_log["pe_theta"],
-        })
+        snapshots.append(snapshot)
 
         print(f"🕒 {timestamp.strftime('%H:%M')} | CE Δ: {round(ce_delta_sum,1)} | PE Δ: {round(pe_delta_sum,1)}")
 
@@ -154,9 +184,15 @@ for i, timestamp in enumerate(intervals):
         print(f"⚠️ {timestamp.strftime('%H:%M')} – Skipped due to error: {e}")
         continue
 
-# Save final logs
-if log_records:
-    pd.DataFrame(log_records).to_csv("greeks_log_historical.csv", index=False)
+# Save final logs: the raw per-interval sums (same columns as greeks_open.csv);
+# sentiment_tracker.py computes the change against the 9:15 baseline
+if snapshots:
+    log_df = pd.DataFrame(snapshots, columns=["timestamp"] + GREEK_COLS)
+    log_df.to_csv("greeks_log_historical.csv", index=False)
     print("✅ Saved full log to greeks_log_historical.csv")
+    if HAVE_PYARROW:
+        # Columnar copy: typed timestamps, no CSV tokenizing on read
+        log_df.to_parquet("greeks_log_historical.parquet", engine="pyarrow", compression="zstd", index=False)
+        print("✅ Saved full log to greeks_log_historical.parquet")
 else:
     print("⚠️ No log records to save.")
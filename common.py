@@ -0,0 +1,24 @@
+# common.py
+# Optional accelerators and the Sheets writer client shared by the scripts and the dashboard
+import json
+import gspread
+from google.oauth2.service_account import Credentials
+try:
+    import orjson  # optional: faster parsing of the GCREDS blob
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+try:
+    import pyarrow  # noqa: F401  optional: Parquet log copy and multithreaded CSV parsing
+    HAVE_PYARROW = True
+except ImportError:
+    HAVE_PYARROW = False
+CSV_ENGINE = "pyarrow" if HAVE_PYARROW else "c"
+
+# ----------------- Google Sheets Auth ------------
+SCOPE = ["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"]
+
+def authorize_writer(info):
+    """gspread client for a service-account dict; retries 429/5xx with exponential backoff instead of failing the run."""
+    creds = Credentials.from_service_account_info(info, scopes=SCOPE)
+    return gspread.authorize(creds, http_client=gspread.BackOffHTTPClient)
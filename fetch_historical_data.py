@@ -5,25 +5,19 @@ import datetime
 import pytz
 import pandas as pd
 from kiteconnect import KiteConnect
-from oauth2client.service_account import ServiceAccountCredentials
-import gspread
+from common import json_loads, authorize_writer
 
 # -------------------- LOAD CREDENTIALS --------------------
 raw = os.environ.get("GCREDS") or os.environ.get("gcreds")
 if not raw:
     raise RuntimeError("❌ GCREDS not found in environment.")
 try:
-    gcreds = json.loads(raw)
+    gcreds = json_loads(raw)
 except json.JSONDecodeError as e:
     raise RuntimeError(f"❌ GCREDS is not valid JSON: {e}")
 
 # -------------------- GOOGLE SHEETS AUTH --------------------
-scope = [
-    "https://spreadsheets.google.com/feeds",
-    "https://www.googleapis.com/auth/drive"
-]
-creds = ServiceAccountCredentials.from_json_keyfile_dict(gcreds, scope)
-gc = gspread.authorize(creds)
+gc = authorize_writer(gcreds)
 
 # Open token store and OHLCData sheets by ID
 service_account = gcreds.get("client_email", "<unknown>")
@@ -45,8 +39,9 @@ except Exception as e:
 
 # Read Zerodha API tokens
 cfg = token_wb.worksheet("Sheet1")
-api_key = cfg.acell("A1").value.strip()
-access_token = cfg.acell("C1").value.strip()
+# A1 = api_key, B1 = api_secret, C1 = access_token, D1 = last updated; one batchGet instead of a read per cell
+token_row = (cfg.batch_get(["A1:D1"])[0] or [[]])[0]
+api_key, _, access_token, _ = (c.strip() for c in (token_row + [""] * 4)[:4])
 
 # Prepare OHLC worksheet
 try:
@@ -103,34 +98,29 @@ try:
     )
     df = pd.DataFrame(candles)
 
-    # convert to IST timezone safely
-    df['date'] = pd.to_datetime(df['date'])
-    try:
-        df['date'] = df['date'].dt.tz_localize('UTC').dt.tz_convert(ist)
-    except TypeError:
-        df['date'] = df['date'].dt.tz_convert(ist)
+    # convert to IST timezone safely (naive values are treated as UTC, aware ones are converted)
+    df['date'] = pd.to_datetime(df['date'], utc=True, cache=True).dt.tz_convert(ist)
 
-    # Clear sheet and write headers
+    # Clear sheet
     try:
         ohlc_ws.clear()
-        headers = ['date', 'open', 'high', 'low', 'close', 'volume']
-        ohlc_ws.append_row(headers)
     except Exception as e:
         raise RuntimeError(
-            f"❌ Permission error writing headers: {e}\n"
+            f"❌ Permission error clearing sheet: {e}\n"
             f"Ensure the service account ({service_account}) has Editor rights on the OHLCData sheet and its 'OHLC' tab."
         )
 
-    # Append all candle rows
+    # Write headers and all candle rows in a single update
+    headers = ['date', 'open', 'high', 'low', 'close', 'volume']
     rows = df[['date','open','high','low','close','volume']].apply(
         lambda r: [r['date'].isoformat(), r['open'], r['high'], r['low'], r['close'], r['volume']],
         axis=1
     ).tolist()
     try:
-        ohlc_ws.append_rows(rows, value_input_option='USER_ENTERED')
+        ohlc_ws.update(range_name='A1', values=[headers] + rows, value_input_option='USER_ENTERED')
     except Exception as e:
         raise RuntimeError(
-            f"❌ Permission error appending rows: {e}\n"
+            f"❌ Permission error writing rows: {e}\n"
             f"Ensure the service account ({service_account}) has Editor rights on the OHLCData sheet and its 'OHLC' tab."
         )
 
@@ -2,14 +2,14 @@ import os
 import json
 import logging
 import datetime
+from concurrent.futures import ThreadPoolExecutor
 import pytz
 import numpy as np
-import gspread
 import yfinance as yf
 import pandas as pd  # needed for DataFrame operations
 from scipy.stats import norm
-from oauth2client.service_account import ServiceAccountCredentials
 from gspread.exceptions import WorksheetNotFound
+from common import json_loads, authorize_writer
 
 # ----------------- Configuration -----------------
 GCREDS_ENV_VAR       = "GCREDS"
@@ -33,6 +33,8 @@ HEADER = [
     "bn_ce_delta","bn_ce_vega","bn_ce_theta",
     "bn_pe_delta","bn_pe_vega","bn_pe_theta"
 ]
+SIDES    = ('ce', 'pe')
+ACC_KEYS = tuple(f'{side}_{greek}' for side in SIDES for greek in ('delta', 'vega', 'theta'))
 
 # ----------------- Logging ------------------------
 def setup_logging():
@@ -54,26 +56,26 @@ def load_config():
 def authorize_sheets():
     creds_data = os.getenv(GCREDS_ENV_VAR)
     if creds_data:
-        creds = json.loads(creds_data)
+        creds = json_loads(creds_data)
     elif os.path.exists("credentials.json"):
         with open("credentials.json") as f:
             creds = json.load(f)
     else:
         raise RuntimeError("Service account JSON not found in env var or credentials.json")
-    scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-    credentials = ServiceAccountCredentials.from_json_keyfile_dict(creds, scope)
-    return gspread.authorize(credentials)
+    return authorize_writer(creds)
 
 # ----------------- Black-Scholes Greeks ------------
 def calculate_greeks(S, K, T, r, vol, flag):
-    d1 = (np.log(S/K) + (r + 0.5*vol**2)*T) / (vol * np.sqrt(T))
-    d2 = d1 - vol*np.sqrt(T)
+    sqrt_t = np.sqrt(T)
+    d1 = (np.log(S/K) + (r + 0.5*vol**2)*T) / (vol * sqrt_t)
+    d2 = d1 - vol*sqrt_t
+    pdf_d1 = norm.pdf(d1)
     delta = norm.cdf(d1) if flag=='CE' else -norm.cdf(-d1)
-    vega = S * norm.pdf(d1) * np.sqrt(T)
+    vega = S * pdf_d1 * sqrt_t
     if flag=='CE':
-        theta = -S*norm.pdf(d1)*vol/(2*np.sqrt(T)) - r*K*np.exp(-r*T)*norm.cdf(d2)
+        theta = -S*pdf_d1*vol/(2*sqrt_t) - r*K*np.exp(-r*T)*norm.cdf(d2)
     else:
-        theta = -S*norm.pdf(d1)*vol/(2*np.sqrt(T)) + r*K*np.exp(-r*T)*norm.cdf(-d2)
+        theta = -S*pdf_d1*vol/(2*sqrt_t) + r*K*np.exp(-r*T)*norm.cdf(-d2)
     return delta, vega, theta
 
 # ----------------- Fetch via yfinance ----------------
@@ -83,7 +85,7 @@ def fetch_greeks_yf(ticker_symbol: str):
     Returns dict with ce_delta, ce_vega, ce_theta, pe_delta, pe_vega, pe_theta.
     """
     # Prepare zero accumulator for fallback
-    zero_acc = {'ce_delta':0.0,'ce_vega':0.0,'ce_theta':0.0,'pe_delta':0.0,'pe_vega':0.0,'pe_theta':0.0}
+    zero_acc = dict.fromkeys(ACC_KEYS, 0.0)
     try:
         tk = yf.Ticker(ticker_symbol)
         info = tk.info
@@ -112,95 +114,75 @@ def fetch_greeks_yf(ticker_symbol: str):
         logging.warning("Invalid expiry date format %s for %s", exp, ticker_symbol)
         return zero_acc
     # allocate
-    acc = {'ce_delta':0.0,'ce_vega':0.0,'ce_theta':0.0,'pe_delta':0.0,'pe_vega':0.0,'pe_theta':0.0}
-    # process calls and puts
+    acc = dict.fromkeys(ACC_KEYS, 0.0)
+    # process calls and puts: Greeks for the whole chain in one vectorized pass per side
     for df, side in ((calls, 'CE'), (puts, 'PE')):
         # if not a DataFrame, skip
-        if not isinstance(df, pd.DataFrame):
+        if not isinstance(df, pd.DataFrame) or T <= 0:
             continue
-        for row in df.itertuples(index=False):
-            K = getattr(row, 'strike', None)
-            price = getattr(row, 'lastPrice', None)
-            iv = getattr(row, 'impliedVolatility', None)
-            if K is None or price is None or iv is None or T <= 0:
-                continue
-            # iv from yfinance is already decimal (e.g., 0.25)
+        # rows with a missing strike or IV come out as NaN Greeks and fail the delta filter below
+        K  = df['strike'].to_numpy(dtype=np.float64)
+        # iv from yfinance is already decimal (e.g., 0.25)
+        iv = df['impliedVolatility'].to_numpy(dtype=np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
             delta, vega, theta = calculate_greeks(S, K, T, RISK_FREE_RATE, iv, side)
-            key_pref = side.lower()
-            if DELTA_MIN <= abs(delta) <= DELTA_MAX:
-                acc[f'{key_pref}_delta'] += delta
-                acc[f'{key_pref}_vega']  += vega
-                acc[f'{key_pref}_theta'] += theta
-    return acc
-    """
-    Fetch option chain using yfinance for given ticker.
-    Returns dict with ce_delta, ce_vega, ce_theta, pe_delta, pe_vega, pe_theta.
-    """
-    tk = yf.Ticker(ticker_symbol)
-    info = tk.info
-    S = info.get('regularMarketPrice')
-    if S is None:
-        raise RuntimeError(f"Cannot fetch underlying price for {ticker_symbol}")
-    # choose nearest expiry
-    expiries = tk.options
-    if not expiries:
-        raise RuntimeError(f"No expiry dates for {ticker_symbol}")
-    exp = expiries[0]
-    chain = tk.option_chain(exp)
-    calls = chain.calls
-    puts  = chain.puts
-    now = datetime.datetime.now(IST)
-    exp_dt = datetime.datetime.strptime(exp, '%Y-%m-%d').replace(tzinfo=IST)
-    T = (exp_dt - now).total_seconds() / (365*24*3600)
-    # allocate
-    acc = {'ce_delta':0.0,'ce_vega':0.0,'ce_theta':0.0,'pe_delta':0.0,'pe_vega':0.0,'pe_theta':0.0}
-    # process calls
-    for opt in [calls, puts]:
-        side = 'CE' if opt is calls else 'PE'
-        for row in opt.itertuples(index=False):
-            K = getattr(row, 'strike', None)
-            price = getattr(row, 'lastPrice', None)
-            iv = getattr(row, 'impliedVolatility', None)
-            if K is None or price is None or iv is None:
-                continue
-            # iv from yfinance is decimal (e.g., 0.25)
-            delta, vega, theta = calculate_greeks(S, K, T, RISK_FREE_RATE, iv, side)
-            key_pref = side.lower()
-            if DELTA_MIN <= abs(delta) <= DELTA_MAX:
-                acc[f'{key_pref}_delta'] += delta
-                acc[f'{key_pref}_vega']  += vega
-                acc[f'{key_pref}_theta'] += theta
+        abs_delta = np.abs(delta)
+        mask = (abs_delta >= DELTA_MIN) & (abs_delta <= DELTA_MAX)
+        key_pref = side.lower()
+        # one masked gather and one reduction for all three Greeks
+        d_sum, v_sum, t_sum = np.vstack((delta, vega, theta))[:, mask].sum(axis=1).tolist()
+        acc[f'{key_pref}_delta'] += d_sum
+        acc[f'{key_pref}_vega']  += v_sum
+        acc[f'{key_pref}_theta'] += t_sum
     return acc
 
 # ----------------- Write to Sheets ------------------
-def write_sheets(client, greeks_key, row):
+def write_sheets(client, greeks_key, row, now):
     book    = client.open_by_key(greeks_key)
-    log_ws  = book.worksheet(LOG_SHEET_NAME)
-    open_ws = book.worksheet(OPEN_SHEET_NAME)
-    vals = log_ws.get_all_values()
-    if not vals or vals[0]!=HEADER:
+    # one metadata fetch resolves every tab, one values.batchGet reads both log and open snapshot
+    tabs = {ws.title: ws for ws in book.worksheets()}
+    for name in (LOG_SHEET_NAME, OPEN_SHEET_NAME):
+        if name not in tabs:
+            raise WorksheetNotFound(name)
+    log_ws  = tabs[LOG_SHEET_NAME]
+    open_ws = tabs[OPEN_SHEET_NAME]
+    log_range, open_range = book.values_batch_get([LOG_SHEET_NAME, OPEN_SHEET_NAME])['valueRanges']
+    all_vals = log_range.get('values', [])
+    ov       = open_range.get('values', [])
+    if not all_vals or all_vals[0] != HEADER:
+        # reset: header + first row in one write
         log_ws.clear()
-        log_ws.append_row(HEADER)
-    log_ws.append_row(row, value_input_option='USER_ENTERED')
+        log_ws.update(range_name='A1', values=[HEADER, row], value_input_option='USER_ENTERED')
+        all_vals = [HEADER]
+    else:
+        log_ws.append_rows([row], value_input_option='USER_ENTERED')
     # archive
-    cutoff = (datetime.datetime.now(IST)-datetime.timedelta(days=RETENTION_DAYS)).date()
-    all_vals = log_ws.get_all_values()
-    archive = [r for r in all_vals[1:] if datetime.datetime.strptime(r[0], '%Y-%m-%d %H:%M:%S').date()<cutoff]
+    cutoff = (now-datetime.timedelta(days=RETENTION_DAYS)).date()
+    # batchGet trims trailing empty cells; the padded NaNs go back to the sheet as blanks
+    log_df = pd.DataFrame(all_vals[1:], columns=all_vals[0]).fillna('')
+    old = (pd.to_datetime(log_df['timestamp'], format='%Y-%m-%d %H:%M:%S') < pd.Timestamp(cutoff)).to_numpy()
+    archive = log_df[old].values.tolist()
     if archive:
-        try:
-            arc_ws = book.worksheet(ARCHIVE_SHEET_NAME)
-        except WorksheetNotFound:
+        arc_ws = tabs.get(ARCHIVE_SHEET_NAME)
+        if arc_ws is None:
             arc_ws = book.add_worksheet(ARCHIVE_SHEET_NAME, rows='100', cols=str(len(HEADER)))
-            arc_ws.append_row(HEADER)
+            archive = [HEADER] + archive
         arc_ws.append_rows(archive, value_input_option='USER_ENTERED')
-        for idx in range(len(all_vals),1,-1):
-            rd = datetime.datetime.strptime(all_vals[idx-1][0], '%Y-%m-%d %H:%M:%S').date()
-            if rd < cutoff:
-                log_ws.delete_row(idx)
-    ov = open_ws.get_all_values()
-    today = datetime.datetime.now(IST).strftime('%Y-%m-%d')
-    if len(ov)<2 or not ov[1][0].startswith(today):
-        open_ws.clear(); open_ws.append_row(HEADER); open_ws.append_row(row)
+        # data row i is 0-based grid row i+1; delete each contiguous run in one batchUpdate,
+        # bottom-up so earlier deletes don't shift the later ranges
+        idx = np.flatnonzero(old) + 1
+        runs = np.split(idx, np.flatnonzero(np.diff(idx) != 1) + 1)
+        book.batch_update({'requests': [
+            {'deleteDimension': {'range': {'sheetId': log_ws.id, 'dimension': 'ROWS',
+                                           'startIndex': int(r[0]), 'endIndex': int(r[-1]) + 1}}}
+            for r in reversed(runs)
+        ]})
+    today = now.date().isoformat()
+    if len(ov)<2 or not ov[1] or not ov[1][0].startswith(today):
+        # header + snapshot in one write; clear only if stray rows would survive the overwrite
+        if len(ov) > 2:
+            open_ws.clear()
+        open_ws.update(range_name='A1', values=[HEADER, row], value_input_option='USER_ENTERED')
 
 # ----------------- Main ---------------------------
 def main():
@@ -210,13 +192,16 @@ def main():
     client = authorize_sheets()
     tickers = {'nifty':'^NSEI','bn':'^NSEBANK'}
     now = datetime.datetime.now(IST)
-    row = [now.strftime('%Y-%m-%d %H:%M:%S')]
-    for key, sym in tickers.items():
-        acc = fetch_greeks_yf(sym)
-        for side in ['ce','pe']:
+    # one clock read for the row, the archive cutoff and the open-snapshot day
+    row = [now.replace(tzinfo=None).isoformat(sep=' ', timespec='seconds')]
+    # Both option chains are network-bound, so fetch them concurrently
+    with ThreadPoolExecutor(max_workers=len(tickers)) as pool:
+        accs = list(pool.map(fetch_greeks_yf, tickers.values()))
+    for acc in accs:
+        for side in SIDES:
             row += [round(acc[f'{side}_delta'],4), round(acc[f'{side}_vega'],2), round(acc[f'{side}_theta'],2)]
     print('DEBUG OUTPUT ROW:', row)
-    write_sheets(client, greeks_key, row)
+    write_sheets(client, greeks_key, row, now)
     logging.info('Completed fetch via yfinance')
 
 if __name__=='__main__':
@@ -1,20 +1,28 @@
 import os
+import json
+import time
+import tempfile
 import streamlit as st
 import pandas as pd
-import datetime
-import pytz
+import numpy as np
 import gspread
-from oauth2client.service_account import ServiceAccountCredentials
-from streamlit_autorefresh import st_autorefresh
-import fetch_option_data  # ensure this module is importable
+from gspread.utils import rowcol_to_a1
+from google.oauth2.service_account import Credentials
+import fetch_option_data
+from common import CSV_ENGINE, json_loads
 
 # ---------- PAGE CONFIGURATION ----------
 st.set_page_config(page_title="📈 Greeks Sentiment Tracker", layout="wide")
 
 # ---------- STREAMLIT SECRETS & CONSTANTS ----------
-# Load credentials and IDs from Streamlit secrets
+# Load credentials and IDs from Streamlit secrets; the credentials are resolved once per process
+@st.cache_resource
+def load_gcreds():
+    raw = st.secrets["GCREDS"]
+    return json_loads(raw) if isinstance(raw, str) else dict(raw)
+
 try:
-    creds_dict = st.secrets["GCREDS"]
+    load_gcreds()
 except KeyError:
     st.error("Service account credentials not found. Please define [GCREDS] in Streamlit secrets.")
     st.stop()
@@ -24,58 +32,182 @@ try:
 except KeyError as e:
     st.error(f"Missing secret: {e}. Please add GREEKS_SHEET_ID and TOKEN_SHEET_ID to Streamlit secrets.")
     st.stop()
+# Optional: tab gids for reading a link-shared sheet through its CSV export
+try:
+    public_gids = (st.secrets["GREEKS_LOG_GID"], st.secrets["GREEKS_OPEN_GID"])
+except KeyError:
+    public_gids = None
 
-LOG_WS  = "GreeksLog"
-OPEN_WS = "GreeksOpen"
-HEADER  = [
-    "timestamp",
-    "nifty_ce_delta", "nifty_ce_vega", "nifty_ce_theta",
-    "nifty_pe_delta", "nifty_pe_vega", "nifty_pe_theta",
-    "bn_ce_delta",    "bn_ce_vega",    "bn_ce_theta",
-    "bn_pe_delta",    "bn_pe_vega",    "bn_pe_theta"
-]
+# Sheet layout is shared with the fetch script that writes it
+LOG_WS  = fetch_option_data.LOG_SHEET_NAME
+OPEN_WS = fetch_option_data.OPEN_SHEET_NAME
+HEADER  = fetch_option_data.HEADER
+GREEK_COLS = HEADER[1:]
+INDEXES    = (('nifty','NIFTY'),('bn','BANKNIFTY'))
+# Numbers come back as JSON numbers; dates keep their sheet formatting
+READ_PARAMS = {"valueRenderOption": "UNFORMATTED_VALUE", "dateTimeRenderOption": "FORMATTED_STRING"}
 
 # ---------- AUTHENTICATE GOOGLE SHEETS ----------
-scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
-client = gspread.authorize(creds)
-wb = client.open_by_key(greeks_sheet_id)
-
-
-# ---------- ENSURE HEADER & INITIAL DATA ----------
-log_sheet = wb.worksheet(LOG_WS)
-vals = log_sheet.get_all_values()
-# Create header if missing
-if not vals or vals[0] != HEADER:
-    log_sheet.clear()
-    log_sheet.append_row(HEADER)
-    st.info("Initialized 'GreeksLog' with headers. Please run your fetch script to populate data.")
-    st.stop()
-# If header exists but no data rows
-if len(vals) < 2:
-    st.info("No data rows found in 'GreeksLog'. Please run `fetch_option_data.py` to log the first data point.")
-    st.stop()
-headers = vals[0]
-rows    = vals[1:]
-
-# ---------- LOAD DATAFRAME ----------
-df = pd.DataFrame(rows, columns=headers)
-df['timestamp'] = pd.to_datetime(df['timestamp'], format='%Y-%m-%d %H:%M:%S')
-df['timestamp'] = df['timestamp'].dt.tz_localize('UTC').dt.tz_convert('Asia/Kolkata')
-for col in headers[1:]:
-    df[col] = pd.to_numeric(df[col], errors='coerce')
-
-# ---------- OPEN SNAPSHOT ----------
-open_sheet = wb.worksheet(OPEN_WS)
-open_vals  = open_sheet.get_all_values()
-if len(open_vals) >= 2 and open_vals[0] == HEADER:
-    open_series = pd.Series(open_vals[1], index=open_vals[0]).drop('timestamp').astype(float)
-else:
-    open_series = df.iloc[0].drop('timestamp').astype(float)
-
-# ---------- CALCULATE CHANGES ----------
-latest  = df.iloc[-1]
-changes = {col: latest[col] - open_series[col] for col in open_series.index}
+scope = ["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"]
+
+@st.cache_resource
+def get_gc():
+    creds = Credentials.from_service_account_info(load_gcreds(), scopes=scope)
+    return gspread.authorize(creds)
+
+@st.cache_resource
+def get_workbook(sheet_id):
+    return get_gc().open_by_key(sheet_id)
+
+# ---------- CACHED SHEET READS ----------
+# Minute-level reads expire just under the 60s refresh so each tick sees fresh data
+def sheet_frame(vals):
+    if not vals:
+        return pd.DataFrame()
+    # batchGet trims trailing empty cells, so pad rows out to the header width
+    width = len(vals[0])
+    return pd.DataFrame([r + [None] * (width - len(r)) for r in vals[1:]], columns=vals[0])
+
+@st.cache_data(ttl=600, show_spinner=False)
+def load_log(sheet_id):
+    # The full log is only re-read every 10 min; load_tail keeps its end and the open row fresh
+    resp = get_workbook(sheet_id).values_get(LOG_WS, params=READ_PARAMS)
+    return sheet_frame(resp.get('values'))
+
+@st.cache_data(ttl=55, show_spinner=False)
+def load_tail(sheet_id, start_row):
+    # One values.batchGet per tick: log rows from start_row to the end (the last row we already know
+    # plus anything appended since) and the open snapshot, which write_sheets rolls each day
+    last_col = rowcol_to_a1(1, len(HEADER))[:-1]
+    resp = get_workbook(sheet_id).values_batch_get(
+        ranges=[f"{LOG_WS}!A{start_row}:{last_col}", f"{OPEN_WS}!A1:{last_col}2"], params=READ_PARAMS)
+    tail_range, open_range = resp.get('valueRanges', [{}, {}])
+    return sheet_frame([HEADER] + tail_range.get('values', [])), sheet_frame(open_range.get('values'))
+
+@st.cache_data(ttl=55, show_spinner=False)
+def load_sheets_csv(sheet_id, log_gid, open_gid):
+    # Unauthenticated CSV export of a link-shared sheet: one GET per tab, parsed by pyarrow when installed
+    base = f"https://docs.google.com/spreadsheets/d/{sheet_id}/export?format=csv&gid="
+    return (pd.read_csv(base + str(log_gid), engine=CSV_ENGINE, dtype={'timestamp': str}),
+            pd.read_csv(base + str(open_gid), engine=CSV_ENGINE, dtype={'timestamp': str}))
+
+def fetch_greeks():
+    """Return the (log, open) frames, or None after showing a setup message."""
+    if public_gids:
+        try:
+            df, df_open = load_sheets_csv(greeks_sheet_id, *public_gids)
+            if list(df.columns) == HEADER and not df.empty:
+                return df, df_open
+        except Exception:
+            pass  # not link-shared or unreachable: fall back to the authenticated reads
+
+    # ---------- ENSURE HEADER & INITIAL DATA ----------
+    df = load_log(greeks_sheet_id)
+    # Create header if missing
+    if list(df.columns) != HEADER:
+        log_sheet = get_workbook(greeks_sheet_id).worksheet(LOG_WS)
+        log_sheet.clear()
+        log_sheet.append_row(HEADER)
+        load_log.clear()
+        st.info("Initialized 'GreeksLog' with headers. Please run your fetch script to populate data.")
+        return None
+    # If header exists but no data rows
+    if df.empty:
+        st.info("No data rows found in 'GreeksLog'. Please run `fetch_option_data.py` to log the first data point.")
+        return None
+
+    # Refresh the tail of the log and the open row every minute; sheet row 1 is the header,
+    # so the last known row is len(df) + 1
+    tail, df_open = load_tail(greeks_sheet_id, len(df) + 1)
+    if not tail.empty and tail['timestamp'].iat[0] == df['timestamp'].iat[-1]:
+        df = pd.concat([df.iloc[:-1], tail], ignore_index=True)
+    else:
+        # The anchor row moved (old rows were archived since the full read): re-read the whole log
+        load_log.clear()
+        df = load_log(greeks_sheet_id)
+        if df.empty or list(df.columns) != HEADER:
+            return None
+    return df, df_open
+
+# ---------- LAST-KNOWN-GOOD SNAPSHOT ----------
+SNAPSHOT_MAX_AGE = 300  # seconds
+
+# Plain JSON in a directory owned by the app, not the shared temp dir: reading it never executes code
+SNAPSHOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".snapshots")
+
+def snapshot_path(sheet_id):
+    return os.path.join(SNAPSHOT_DIR, f"greeks_snapshot_{sheet_id}.json")
+
+def frame_payload(frame):
+    # NaN -> null so the strict orjson parser accepts it
+    return {'columns': list(frame.columns),
+            'data': frame.astype(object).where(frame.notna(), None).values.tolist()}
+
+def read_snapshot(newer_than):
+    """Return the saved (log, open) frames if written after `newer_than` (epoch seconds), else None."""
+    path = snapshot_path(greeks_sheet_id)
+    try:
+        if os.path.getmtime(path) > newer_than:
+            with open(path, 'rb') as f:
+                payload = json_loads(f.read())
+            return tuple(pd.DataFrame(p['data'], columns=p['columns']) for p in (payload['log'], payload['open']))
+    except Exception:
+        pass  # missing or unreadable snapshot: fetch live
+    return None
+
+def write_snapshot(frames):
+    """Atomically replace the saved snapshot with `frames`; failures only cost the next cold start."""
+    try:
+        os.makedirs(SNAPSHOT_DIR, mode=0o700, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=SNAPSHOT_DIR, suffix='.tmp')
+    except OSError:
+        return
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'log': frame_payload(frames[0]), 'open': frame_payload(frames[1])}, f)
+        os.replace(tmp, snapshot_path(greeks_sheet_id))
+    except (OSError, TypeError, ValueError):
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+
+def open_stamp(frame):
+    return frame['timestamp'].iat[0] if not frame.empty and 'timestamp' in frame.columns else None
+
+def snapshot_is_current(frames):
+    """True if the sheet has no log rows after the snapshot's last one and the open row is unchanged (one small read)."""
+    df, df_open = frames
+    if df.empty or 'timestamp' not in df.columns:
+        return False
+    try:
+        tail, open_now = load_tail(greeks_sheet_id, len(df) + 1)
+    except Exception:
+        return False
+    return (len(tail) == 1 and tail['timestamp'].iat[0] == df['timestamp'].iat[-1]
+            and open_stamp(open_now) == open_stamp(df_open))
+
+@st.cache_resource
+def process_state():
+    return {'served_snapshot': False}
+
+def read_greeks():
+    """Like fetch_greeks, but serves the on-disk snapshot on a cold start and while the sheet hasn't moved past it."""
+    state = process_state()
+    if not state['served_snapshot']:
+        state['served_snapshot'] = True
+        frames = read_snapshot(time.time() - SNAPSHOT_MAX_AGE)
+        if frames is not None:
+            return frames
+    # The fetch workflow runs around the clock, so any older snapshot is checked against the sheet's tail and open row
+    frames = read_snapshot(0)
+    if frames is not None and snapshot_is_current(frames):
+        return frames
+    frames = fetch_greeks()
+    if frames is not None:
+        write_snapshot(frames)
+    return frames
+
 
 # ---------- SENTIMENT LOGIC ----------
 def classify_sentiment(ce_v, pe_v, ce_t, pe_t):
@@ -92,30 +224,84 @@ def classify_sentiment(ce_v, pe_v, ce_t, pe_t):
     return s
 
 # ---------- BUILD SUMMARY ----------
-rows_out = []
-today    = datetime.datetime.now(pytz.timezone('Asia/Kolkata'))
-for key, label in [('nifty','NIFTY'),('bn','BANKNIFTY')]:
-    ce_d,ce_v,ce_t = changes[f"{key}_ce_delta"], changes[f"{key}_ce_vega"], changes[f"{key}_ce_theta"]
-    pe_d,pe_v,pe_t = changes[f"{key}_pe_delta"], changes[f"{key}_pe_vega"], changes[f"{key}_pe_theta"]
-    sent = classify_sentiment(ce_v, pe_v, ce_t, pe_t)
-    for opt, d, v, t in [('CE', ce_d, ce_v, ce_t), ('PE', pe_d, pe_v, pe_t)]:
-        rows_out.append({'Instrument':f"{label} {opt}",'SENTIMENT':sent,'DELTA':d,'VEGA':v,'THETA':t})
-oi_cols=[c for c in headers if c.endswith('_oi')]
-if oi_cols:
-    for e in rows_out:
-        p = 'nifty' if 'NIFTY' in e['Instrument'] and 'BANKNIFTY' not in e['Instrument'] else 'bn'
-        o = 'ce' if e['Instrument'].endswith('CE') else 'pe'
-        e['OI'] = changes.get(f"{p}_{o}_oi")
-summary_df = pd.DataFrame(rows_out)
+def build_summary(changes, headers):
+    rows_out = []
+    for key, label in INDEXES:
+        ce_d,ce_v,ce_t = changes[f"{key}_ce_delta"], changes[f"{key}_ce_vega"], changes[f"{key}_ce_theta"]
+        pe_d,pe_v,pe_t = changes[f"{key}_pe_delta"], changes[f"{key}_pe_vega"], changes[f"{key}_pe_theta"]
+        sent = classify_sentiment(ce_v, pe_v, ce_t, pe_t)
+        for opt, d, v, t in [('CE', ce_d, ce_v, ce_t), ('PE', pe_d, pe_v, pe_t)]:
+            rows_out.append({'Instrument':f"{label} {opt}",'SENTIMENT':sent,'DELTA':d,'VEGA':v,'THETA':t})
+    oi_cols=[c for c in headers if c.endswith('_oi')]
+    if oi_cols:
+        for e in rows_out:
+            p = 'nifty' if 'NIFTY' in e['Instrument'] and 'BANKNIFTY' not in e['Instrument'] else 'bn'
+            o = 'ce' if e['Instrument'].endswith('CE') else 'pe'
+            e['OI'] = changes.get(f"{p}_{o}_oi")
+    return pd.DataFrame(rows_out)
+
+# ---------- SUMMARY TABLE HTML ----------
+# Bound str.format methods so each cell is formatted with a single call
+NUM_FORMATS = {'DELTA':'{:.4f}'.format,'VEGA':'{:.2f}'.format,'THETA':'{:.2f}'.format,'OI':'{:.0f}'.format}
+
+def summary_html(summary_df):
+    num_cols  = [c for c in summary_df.columns if c in NUM_FORMATS]
+    fmts      = [NUM_FORMATS[c] for c in num_cols]
+    text_vals = summary_df.drop(columns=num_cols).to_numpy()
+    num_vals  = summary_df[num_cols].to_numpy(dtype=np.float64)
+    styles    = np.select([num_vals > 0, num_vals < 0], ['color:green', 'color:red'], default='color:black')
+    parts = ["<table><tr>", *(f"<th>{c}</th>" for c in summary_df.columns), "</tr>"]
+    for t_row, n_row, s_row in zip(text_vals, num_vals, styles):
+        parts.append("<tr>")
+        parts.extend(f"<td>{t}</td>" for t in t_row)
+        parts.extend(f"<td style='{css}'>{fmt(v)}</td>" for fmt, v, css in zip(fmts, n_row, s_row))
+        parts.append("</tr>")
+    parts.append("</table>")
+    return "".join(parts)
 
 # ---------- DISPLAY ----------
 st.title("📈 Greeks Sentiment Tracker")
-st.caption(f"Last updated: {today.strftime('%d-%b-%Y %I:%M:%S %p IST')}")
-st.subheader("Sentiment Summary")
-st.table(summary_df.style.format({
-    'DELTA':'{:.4f}','VEGA':'{:.2f}','THETA':'{:.2f}',**({'OI':'{:.0f}'} if 'OI' in summary_df.columns else {})
-}))
-st.subheader("Raw Data Log")
-st.download_button(label="Download CSV",data=df.to_csv(index=False),file_name="greeks_log.csv",mime="text/csv")
+
+# Only this panel reruns on the timer; the cached reads above are shared across sessions
+@st.fragment(run_every="60s")
+def live_panel():
+    frames = read_greeks()
+    if frames is None:
+        return
+    df, df_open = frames
+    headers = list(df.columns)
+
+    # ---------- OPEN SNAPSHOT ----------
+    # One float block per frame, then positional row access; blank or text cells become NaN
+    greeks = df[GREEK_COLS].apply(pd.to_numeric, errors='coerce').to_numpy(np.float64)
+    if not df_open.empty and list(df_open.columns) == HEADER:
+        open_arr = df_open[GREEK_COLS].apply(pd.to_numeric, errors='coerce').to_numpy(np.float64)[0]
+    else:
+        open_arr = greeks[0]
+
+    # ---------- CALCULATE CHANGES ----------
+    latest_arr = greeks[-1]
+
+    # Reuse the previous tick's table and CSV when neither the log nor the baseline has moved
+    h = hash((len(df), latest_arr.tobytes(), open_arr.tobytes()))
+    cached = st.session_state.get('live_panel')
+    if cached is not None and cached[0] == h:
+        _, table_html, csv_data = cached
+    else:
+        diff       = latest_arr - open_arr
+        changes    = dict(zip(GREEK_COLS, diff.tolist()))
+        table_html = summary_html(build_summary(changes, headers))
+        csv_data   = df.to_csv(index=False)
+        st.session_state['live_panel'] = (h, table_html, csv_data)
+
+    # Time of the newest logged row, so a snapshot or a stalled fetch never looks fresher than it is
+    last_ts = df['timestamp'].iat[-1]
+    parsed  = pd.to_datetime(last_ts, errors='coerce')
+    st.caption(f"Last updated: {parsed.strftime('%d-%b-%Y %I:%M:%S %p IST') if pd.notna(parsed) else last_ts}")
+    st.subheader("Sentiment Summary")
+    st.markdown(table_html, unsafe_allow_html=True)
+    st.subheader("Raw Data Log")
+    st.download_button(label="Download CSV",data=csv_data,file_name="greeks_log.csv",mime="text/csv")
+
+live_panel()
 st.caption("🔄 Auto-refresh every minute.")
-st_autorefresh(interval=60*1000)
@@ -1,7 +1,10 @@
 import pandas as pd
+import numpy as np
 import os
+import csv
 from datetime import datetime
 import pytz
+from common import CSV_ENGINE, HAVE_PYARROW
 
 # ----------- TIMEZONE SETUP -----------
 ist = pytz.timezone("Asia/Kolkata")
@@ -9,33 +12,32 @@ ist = pytz.timezone("Asia/Kolkata")
 # ----------- FILE PATHS -----------
 open_file = "greeks_open.csv"
 log_file = "greeks_log_historical.csv"
+log_parquet = "greeks_log_historical.parquet"
+
+# ----------- COLUMNS -----------
+GREEK_COLS = ["ce_delta", "pe_delta", "ce_vega", "pe_vega", "ce_theta", "pe_theta"]
+GREEK_DTYPES = dict.fromkeys(GREEK_COLS, "float64")
+# backfill_greeks.py writes naive timestamps in this layout; an explicit format skips per-row inference
+TS_FORMAT = "%Y-%m-%d %H:%M:%S"
 
 # ----------- LOAD BASELINE (MARKET OPEN GREEKS) -----------
 if not os.path.exists(open_file):
     raise FileNotFoundError("❌ Market open baseline file not found.")
 
-open_df = pd.read_csv(open_file)
-open_df["timestamp"] = pd.to_datetime(open_df["timestamp"])
-
-baseline = open_df.iloc[0]  # 9:15 AM snapshot
+# 9:15 AM snapshot as a row vector for the broadcast subtraction below; a one-row file
+# doesn't need a DataFrame, so read it with the stdlib csv module
+with open(open_file, newline="") as f:
+    open_row = next(csv.DictReader(f))
+baseline = np.array([float(open_row[col]) for col in GREEK_COLS])
 
 # ----------- LOAD HISTORICAL LOG -----------
-log_df = pd.read_csv(log_file)
-log_df["timestamp"] = pd.to_datetime(log_df["timestamp"])
+# Prefer the columnar copy written by backfill_greeks.py when pyarrow is available
+if HAVE_PYARROW and os.path.exists(log_parquet):
+    log_df = pd.read_parquet(log_parquet, engine="pyarrow", columns=["timestamp"] + GREEK_COLS)
+else:
+    log_df = pd.read_csv(log_file, engine=CSV_ENGINE, dtype=GREEK_DTYPES, parse_dates=["timestamp"], date_format=TS_FORMAT)
 
 # ----------- COMPARE LIVE TO BASELINE -----------
-summary = []
-
-for _, row in log_df.iterrows():
-    summary.append({
-        "timestamp": row["timestamp"],
-        "ce_delta_change": row["ce_delta"] - baseline["ce_delta"],
-        "pe_delta_change": row["pe_delta"] - baseline["pe_delta"],
-        "ce_vega_change": row["ce_vega"] - baseline["ce_vega"],
-        "pe_vega_change": row["pe_vega"] - baseline["pe_vega"],
-        "ce_theta_change": row["ce_theta"] - baseline["ce_theta"],
-        "pe_theta_change": row["pe_theta"] - baseline["pe_theta"],
-    })
-
-summary_df = pd.DataFrame(summary)
+summary_df = pd.DataFrame(log_df[GREEK_COLS].to_numpy() - baseline, columns=[f"{col}_change" for col in GREEK_COLS])
+summary_df.insert(0, "timestamp", log_df["timestamp"].to_numpy())
 summary_df["timestamp"] = summary_df["timestamp"].dt.tz_localize("Asia/Kolkata")